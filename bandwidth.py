@@ -24,6 +24,28 @@ DESCRIPTION
     object property also may be adjusted to set the limits of the
     history log.
 
+    The history is kept as a list of bin start times and a list of
+    running byte totals, with expired bins skipped by a head index and
+    only trimmed off now and then. So update() takes constant time and
+    bandwidth_covering() finds the start of its timespan with a binary
+    search and gets the byte total with one subtraction.
+
+    The tiered_bandwidth object is used the same way, but keeps a fixed
+    amount of history at several resolutions, like RRDtool. By default
+    it keeps 1 second bins for 5 minutes, 10 second bins for 1 hour and
+    5 minute bins for 24 hours. Every update is counted in each tier, so
+    the coarse tiers are always rolled up from the same bytes as the fine
+    ones. bandwidth_covering() uses the finest tier that covers the
+    timespan, so short windows are accurate to a second. It also keeps
+    1, 5 and 15 minute exponentially weighted moving average rates, like
+    the load average, and the time since bytes were last seen, so that an
+    idle source is noticed quickly.
+
+    Times come from a monotonic clock, so changes to the system time do
+    not upset the calculations. Any other clock function that returns
+    seconds may be given when the object is created, which is useful for
+    tests and benchmarks.
+
 AUTHOR
 
     Noah Spurrier <noah@noah.org>
@@ -53,61 +75,259 @@ VERSION
 import os
 import sys
 import time
+import math
+import bisect
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    try:
+        import ctypes
+        import ctypes.util
+
+        class _timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        _librt = ctypes.CDLL(ctypes.util.find_library('rt') or
+                             ctypes.util.find_library('c'), use_errno=True)
+        _clock_gettime = _librt.clock_gettime
+        _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+        CLOCK_MONOTONIC = 1
+
+        def monotonic():
+            """This returns the seconds of the system monotonic clock. """
+            ts = _timespec()
+            if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+                raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+        monotonic()
+    except (ImportError, AttributeError, TypeError, OSError):
+        monotonic = time.time
 
 
 class bandwidth:
 
-    def __init__(self):
+    def __init__(self, clock=monotonic):
 
-        self.byte_count_history = [[0.0, 0]]
+        self.clock = clock
         self.byte_count_history_max_secs = 15 * 3600
         self.bin_length_secs = 10.0
+        # Bin i started at _times[i] and _totals[i] is the sum of the byte
+        # counts of every bin up to and including bin i. Bins before _head
+        # have expired. _base is the total of the bins already trimmed.
+        self._times = []
+        self._totals = []
+        self._head = 0
+        self._base = 0
 
     def __str__(self):
 
         ss = ''
         ss += '1 minute bandwidth: %f\n' % self.bandwidth_covering(60.0)
         ss += '5 minute bandwidth: %f\n' % self.bandwidth_covering(300.0)
-        ss += 'history length: %d\n' % len(self.byte_count_history)
+        ss += 'history length: %d\n' % len(self)
         ss += 'log of update times and byte counts:\n'
         ss += '    ' + str(self.byte_count_history)
         return ss
 
+    def __len__(self):
+
+        return len(self._times) - self._head
+
+    @property
+    def byte_count_history(self):
+
+        """This returns the history as a list of [bin start time, byte
+        count] pairs, oldest first. """
+
+        history = []
+        for ii in range(self._head, len(self._times)):
+            history.append([self._times[ii],
+                            self._totals[ii] - self._total_before(ii)])
+        return history
+
+    def _total_before(self, index):
+
+        if index > 0:
+            return self._totals[index - 1]
+        return self._base
+
     def update(self, byte_count):
 
-        now_time = time.time()
+        now_time = self.clock()
         # Add byte_count to history. Aggregate into bins of bin_length_secs.
-        if (len(self.byte_count_history) > 0 and
-                now_time - self.byte_count_history[-1][0] <
-                self.bin_length_secs):
-            self.byte_count_history[-1][1] += byte_count
+        if (len(self) > 0 and
+                now_time - self._times[-1] < self.bin_length_secs):
+            self._totals[-1] += byte_count
         else:
-            self.byte_count_history.append([now_time, byte_count])
+            self._times.append(now_time)
+            self._totals.append(self._total_before(len(self._totals)) +
+                                byte_count)
         # Drop byte_counts that are older than byte_count_history_max_secs.
-        # FIXME: Yes, I know lists are inefficient as dequeues.
-        while (len(self.byte_count_history) > 0 and
-                (now_time - self.byte_count_history[0][0]) >
+        times = self._times
+        while (self._head < len(times) and
+                (now_time - times[self._head]) >
                 self.byte_count_history_max_secs):
-            self.byte_count_history.pop(0)
+            self._head += 1
+        # Trim the expired bins once they are half of the lists, so each
+        # bin is copied at most once on average.
+        if self._head > 64 and self._head * 2 > len(times):
+            self._base = self._totals[self._head - 1]
+            del self._times[:self._head]
+            del self._totals[:self._head]
+            self._head = 0
 
     def bandwidth_covering(self, timespan_secs):
 
-        if len(self.byte_count_history) < 1:
+        if len(self) < 1:
             return 0.0
-        now_time = time.time()
-        # Find the point in history newer than timespan_secs.
-        for ii in range(len(self.byte_count_history)):
-            if now_time - self.byte_count_history[ii][0] <= timespan_secs:
-                break
+        now_time = self.clock()
+        times = self._times
+        # Find the oldest bin newer than timespan_secs. If there is none
+        # then the newest bin is used. The search bound is nudged so the
+        # result is the same as testing now_time - time <= timespan_secs.
+        ii = bisect.bisect_left(times, now_time - timespan_secs, self._head)
+        while ii > self._head and now_time - times[ii - 1] <= timespan_secs:
+            ii -= 1
+        while ii < len(times) and now_time - times[ii] > timespan_secs:
+            ii += 1
+        if ii == len(times):
+            ii -= 1
         # Calculate total_time from point in history previously found.
-        time_total = now_time - self.byte_count_history[ii][0]
+        time_total = now_time - times[ii]
+        if time_total <= 0:
+            return 0.0
         # Get the sum of byte counts starting from the point previously found.
-        byte_total = 0
-        for ii in range(ii, len(self.byte_count_history)):
-            byte_total += self.byte_count_history[ii][1]
+        byte_total = self._totals[-1] - self._total_before(ii)
         return byte_total / time_total
 
 
+# (bin length, retention) in seconds of each tier of tiered_bandwidth.
+DEFAULT_TIERS = ((1.0, 300.0), (10.0, 3600.0), (300.0, 86400.0))
+# Time constants in seconds of the tiered_bandwidth moving averages.
+EWMA_WINDOWS = (60.0, 300.0, 900.0)
+
+
+class _tier:
+
+    """This is a ring of byte counts for bins of bin_secs seconds covering
+    retention_secs seconds. Each slot remembers which bin number it holds,
+    so stale slots are never counted. """
+
+    def __init__(self, bin_secs, retention_secs):
+
+        self.bin_secs = bin_secs
+        self.retention_secs = retention_secs
+        # One more slot than the retention for the bin now being filled.
+        self.size = int(math.ceil(retention_secs / bin_secs)) + 1
+        self.counts = [0] * self.size
+        self.bins = [-1] * self.size
+
+    def add(self, bin_number, byte_count):
+
+        slot = bin_number % self.size
+        if self.bins[slot] != bin_number:
+            self.bins[slot] = bin_number
+            self.counts[slot] = 0
+        self.counts[slot] += byte_count
+
+    def total(self, first_bin, last_bin):
+
+        total = 0
+        for bin_number in xrange(first_bin, last_bin + 1):
+            slot = bin_number % self.size
+            if self.bins[slot] == bin_number:
+                total += self.counts[slot]
+        return total
+
+
+class tiered_bandwidth:
+
+    """This tracks bandwidth in constant memory with several tiers of
+    bins. See DEFAULT_TIERS and EWMA_WINDOWS. """
+
+    def __init__(self, tiers=DEFAULT_TIERS, ewma_windows=EWMA_WINDOWS,
+                 clock=monotonic):
+
+        self.clock = clock
+        self.tiers = [_tier(bin_secs, retention_secs)
+                      for bin_secs, retention_secs in sorted(tiers)]
+        self.ewma_windows = ewma_windows
+        self.start_time = clock()
+        self.last_update_time = None
+        self.byte_total = 0
+        self._ewma = [0.0] * len(ewma_windows)
+        self._ewma_time = self.start_time
+
+    def __str__(self):
+
+        ss = ''
+        ss += '1 minute bandwidth: %f\n' % self.bandwidth_covering(60.0)
+        ss += '5 minute bandwidth: %f\n' % self.bandwidth_covering(300.0)
+        ss += 'moving averages: %s\n' % ', '.join(
+            ['%g s %f' % (window, rate) for window, rate in
+             zip(self.ewma_windows, self.ewma())])
+        ss += 'idle seconds: %f\n' % self.idle_secs()
+        return ss
+
+    def update(self, byte_count):
+
+        now_time = self.clock()
+        for tier in self.tiers:
+            tier.add(int(now_time // tier.bin_secs), byte_count)
+        self._decay(now_time)
+        for ii, window in enumerate(self.ewma_windows):
+            self._ewma[ii] += byte_count / window
+        if byte_count:
+            self.last_update_time = now_time
+        self.byte_total += byte_count
+
+    def _decay(self, now_time):
+
+        # Each average is the sum of every byte count weighted by
+        # exp(-age / window), divided by window. A steady rate gives that
+        # same rate once the source has run for a few windows.
+        elapsed = now_time - self._ewma_time
+        if elapsed > 0:
+            for ii, window in enumerate(self.ewma_windows):
+                self._ewma[ii] *= math.exp(-elapsed / window)
+            self._ewma_time = now_time
+
+    def ewma(self):
+
+        """This returns the moving average rates in bytes per second, one
+        for each of ewma_windows. """
+
+        self._decay(self.clock())
+        return list(self._ewma)
+
+    def idle_secs(self):
+
+        """This returns the seconds since bytes were last counted, or since
+        this object was created if they never were. """
+
+        if self.last_update_time is None:
+            return self.clock() - self.start_time
+        return self.clock() - self.last_update_time
+
+    def bandwidth_covering(self, timespan_secs):
+
+        now_time = self.clock()
+        for tier in self.tiers:
+            if tier.retention_secs >= timespan_secs:
+                break
+        last_bin = int(now_time // tier.bin_secs)
+        first_bin = max(int((now_time - timespan_secs) // tier.bin_secs),
+                        last_bin - tier.size + 1)
+        # The window starts at the start of its first bin, but never before
+        # any bytes could have been counted.
+        time_total = now_time - max(first_bin * tier.bin_secs,
+                                    self.start_time)
+        if time_total <= 0:
+            return 0.0
+        return tier.total(first_bin, last_bin) / time_total
+
+
 if __name__ == '__main__':
 
     print('Initializing bandwidth counts...')
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# vim:set ft=python fileencoding=utf-8 sr et ts=4 sw=4 : See help 'modeline'
+"""Input event capture files.
+
+DESCRIPTION
+
+    This module reads and writes capture files of raw kernel input events.
+    A capture file lets the entropy pipeline be run, benchmarked and
+    regression tested on recorded mouse traffic without a mouse and
+    without root. It is used by "entropy-source --record FILE", and an
+    existing capture file may be given to "entropy-source" in place of an
+    input device.
+
+    A capture file starts with a short text header, followed by the event
+    records exactly as they were read from the device. The header is a
+    line with the magic string and format version, then lines of
+    "key: value", then an empty line:
+
+        mtee-capture 1
+        evfmt: llHHi
+        evsize: 24
+        byteorder: little
+        device: /dev/input/event4
+        name: Logitech USB Optical Mouse
+        created: 1381234567.123456
+
+        <records>
+
+    evfmt is the struct format of one record, in native byte order and
+    alignment, given by byteorder. A capture file may only be replayed on
+    a machine with the same record layout. Appending to an existing
+    capture file only adds records, so the file keeps its first header.
+
+    The capture_reader memory-maps the file, so records are sliced out of
+    the page cache without copying them through read() calls.
+
+AUTHOR
+
+    Noah Spurrier <noah@noah.org>
+
+LICENSE
+
+    This license is approved by the OSI and FSF as GPL-compatible.
+        http://opensource.org/licenses/isc-license.txt
+
+    Copyright (c) 2013, Noah Spurrier
+    PERMISSION TO USE, COPY, MODIFY, AND/OR DISTRIBUTE THIS SOFTWARE FOR ANY
+    PURPOSE WITH OR WITHOUT FEE IS HEREBY GRANTED, PROVIDED THAT THE ABOVE
+    COPYRIGHT NOTICE AND THIS PERMISSION NOTICE APPEAR IN ALL COPIES.
+    THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+    WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+    ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+    WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+    ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+    OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+VERSION
+
+    Version 1
+"""
+
+import os
+import sys
+import mmap
+import time
+import struct
+
+CAPTURE_MAGIC = 'mtee-capture'
+CAPTURE_VERSION = 1
+# The header is never allowed to be longer than this.
+MAX_HEADER_BYTES = 4096
+
+
+class CaptureError(Exception):
+
+    """This is raised when a capture file is not valid or does not match
+    the record format it is used with. """
+
+
+def is_capture_file(path):
+
+    """This returns True if path is a regular file that starts with the
+    capture file magic string. """
+
+    if not os.path.isfile(path):
+        return False
+    ff = open(path, 'rb')
+    try:
+        return ff.read(len(CAPTURE_MAGIC) + 1) == CAPTURE_MAGIC + ' '
+    finally:
+        ff.close()
+
+
+def format_header(evfmt, device='', name=''):
+
+    lines = ['%s %d' % (CAPTURE_MAGIC, CAPTURE_VERSION),
+             'evfmt: %s' % evfmt,
+             'evsize: %d' % struct.calcsize(evfmt),
+             'byteorder: %s' % sys.byteorder,
+             'device: %s' % device,
+             'name: %s' % name.replace('\n', ' '),
+             'created: %f' % time.time()]
+    return '\n'.join(lines) + '\n\n'
+
+
+def parse_header(data):
+
+    """This parses the header at the start of data. It returns a dict of
+    the header fields and the offset of the first record. """
+
+    end = data.find('\n\n', 0, MAX_HEADER_BYTES)
+    if end < 0:
+        raise CaptureError('capture header not found')
+    lines = data[:end].split('\n')
+    magic = lines[0].split(' ')
+    if magic[0] != CAPTURE_MAGIC or len(magic) != 2:
+        raise CaptureError('not a capture file')
+    if int(magic[1]) != CAPTURE_VERSION:
+        raise CaptureError('unsupported capture version: %s' % magic[1])
+    header = {}
+    for line in lines[1:]:
+        key, value = line.split(':', 1)
+        header[key.strip()] = value.strip()
+    for key in ('evfmt', 'evsize', 'byteorder'):
+        if key not in header:
+            raise CaptureError('capture header has no %s' % key)
+    header['evsize'] = int(header['evsize'])
+    return header, end + 2
+
+
+class capture_writer:
+
+    """This appends raw event records to a capture file. A header is
+    written if the file is new or empty. If the file already has a header
+    its record format must match evfmt. """
+
+    def __init__(self, path, evfmt, device='', name=''):
+
+        self.path = path
+        self.evfmt = evfmt
+        self.records = 0
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                           0644)
+        if os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, format_header(evfmt, device, name))
+        else:
+            ff = open(path, 'rb')
+            try:
+                header, offset = parse_header(ff.read(MAX_HEADER_BYTES))
+            finally:
+                ff.close()
+            _check_format(header, evfmt)
+
+    def write(self, raw):
+
+        """This appends raw, a string of whole event records. """
+
+        view = buffer(raw)
+        while view:
+            view = view[os.write(self._fd, view):]
+        self.records += len(raw) // struct.calcsize(self.evfmt)
+
+    def close(self):
+
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class capture_reader:
+
+    """This memory-maps a capture file and hands out its raw event records
+    in blocks. The record format of the file must match evfmt, unless
+    evfmt is None. """
+
+    def __init__(self, path, evfmt=None):
+
+        self.path = path
+        ff = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(ff.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            ff.close()
+        self.header, self._start = parse_header(self._map[:MAX_HEADER_BYTES])
+        if evfmt is not None:
+            _check_format(self.header, evfmt)
+        self.evsize = self.header['evsize']
+        # A partly written last record is ignored.
+        self.records = (len(self._map) - self._start) // self.evsize
+        self._offset = self._start
+        self._end = self._start + self.records * self.evsize
+
+    def __len__(self):
+
+        return self.records
+
+    def rewind(self):
+
+        self._offset = self._start
+
+    def read(self, max_records):
+
+        """This returns a string of up to max_records records. The string
+        is empty at the end of the file. """
+
+        start = self._offset
+        self._offset = min(self._end, start + max_records * self.evsize)
+        return self._map[start:self._offset]
+
+    def close(self):
+
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+def _check_format(header, evfmt):
+
+    if (header['evfmt'] != evfmt or
+            header['evsize'] != struct.calcsize(evfmt) or
+            header['byteorder'] != sys.byteorder):
+        raise CaptureError('capture record format %s %s is not %s %s' %
+                           (header['evfmt'], header['byteorder'], evfmt,
+                            sys.byteorder))
+
+
+if __name__ == '__main__':
+
+    # Print the header and record count of each capture file given.
+    for path in sys.argv[1:]:
+        reader = capture_reader(path)
+        print('%s: %d records' % (path, len(reader)))
+        for key in sorted(reader.header):
+            print('    %s: %s' % (key, reader.header[key]))
+        reader.close()
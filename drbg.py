@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# vim:set ft=python fileencoding=utf-8 sr et ts=4 sw=4 : See help 'modeline'
+"""Deterministic random bit generator.
+
+DESCRIPTION
+
+    This module implements HMAC_DRBG with SHA-256 as described in NIST
+    SP 800-90A, using only the standard hashlib module. A DRBG stretches a
+    small amount of true entropy into as many output bytes as are wanted.
+    It is used by "entropy-source --drbg", where the mouse only has to
+    supply seed and reseed material and the DRBG supplies the output.
+
+    After you create the hmac_drbg object with a seed, call generate()
+    with the number of bytes you want. Call reseed() with fresh entropy
+    from time to time. The reseed_policy object decides when that should
+    happen: after a number of output bytes, after a number of seconds, or
+    as soon as enough fresh entropy has been collected.
+
+    HMAC is done with precomputed inner and outer SHA-256 states, which
+    are copied for each block instead of rekeying hmac.new() every time.
+
+AUTHOR
+
+    Noah Spurrier <noah@noah.org>
+
+LICENSE
+
+    This license is approved by the OSI and FSF as GPL-compatible.
+        http://opensource.org/licenses/isc-license.txt
+
+    Copyright (c) 2013, Noah Spurrier
+    PERMISSION TO USE, COPY, MODIFY, AND/OR DISTRIBUTE THIS SOFTWARE FOR ANY
+    PURPOSE WITH OR WITHOUT FEE IS HEREBY GRANTED, PROVIDED THAT THE ABOVE
+    COPYRIGHT NOTICE AND THIS PERMISSION NOTICE APPEAR IN ALL COPIES.
+    THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+    WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+    ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+    WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+    ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+    OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+VERSION
+
+    Version 1
+"""
+
+import sys
+import time
+import hashlib
+
+# Limits from SP 800-90A table 2 for HMAC_DRBG.
+SEED_BYTES = 32
+NONCE_BYTES = 16
+MAX_BYTES_PER_REQUEST = 65536
+RESEED_INTERVAL = 2 ** 48
+
+_IPAD = ''.join([chr(cc ^ 0x36) for cc in range(256)])
+_OPAD = ''.join([chr(cc ^ 0x5c) for cc in range(256)])
+
+
+class ReseedRequired(Exception):
+
+    """This is raised by generate() when the DRBG must be reseeded. """
+
+
+class hmac_drbg:
+
+    def __init__(self, entropy, nonce='', personalization=''):
+
+        if len(entropy) < SEED_BYTES:
+            raise ValueError('need at least %d bytes of entropy' % SEED_BYTES)
+        self._set_key('\x00' * 32)
+        self.value = '\x01' * 32
+        self._update(entropy + nonce + personalization)
+        self.reseed_counter = 1
+
+    def _set_key(self, key):
+
+        # HMAC-SHA-256 of V under the new key is then
+        # outer(inner(V)), with both states copied for each call.
+        key = key.ljust(64, '\x00')
+        self._inner = hashlib.sha256(key.translate(_IPAD))
+        self._outer = hashlib.sha256(key.translate(_OPAD))
+
+    def _hmac(self, data):
+
+        inner = self._inner.copy()
+        inner.update(data)
+        outer = self._outer.copy()
+        outer.update(inner.digest())
+        return outer.digest()
+
+    def _update(self, provided=''):
+
+        self._set_key(self._hmac(self.value + '\x00' + provided))
+        self.value = self._hmac(self.value)
+        if provided:
+            self._set_key(self._hmac(self.value + '\x01' + provided))
+            self.value = self._hmac(self.value)
+
+    def reseed(self, entropy, additional=''):
+
+        if len(entropy) < SEED_BYTES:
+            raise ValueError('need at least %d bytes of entropy' % SEED_BYTES)
+        self._update(entropy + additional)
+        self.reseed_counter = 1
+
+    def generate(self, count, additional=''):
+
+        """This returns count pseudo-random bytes. Requests larger than
+        MAX_BYTES_PER_REQUEST are split into several requests. """
+
+        out = []
+        while count > 0:
+            size = min(count, MAX_BYTES_PER_REQUEST)
+            out.append(self._generate(size, additional))
+            count -= size
+        return ''.join(out)
+
+    def _generate(self, count, additional=''):
+
+        if self.reseed_counter > RESEED_INTERVAL:
+            raise ReseedRequired('reseed counter exceeded')
+        if additional:
+            self._update(additional)
+        blocks = []
+        value = self.value
+        inner = self._inner
+        outer = self._outer
+        for nn in xrange((count + 31) // 32):
+            hh = inner.copy()
+            hh.update(value)
+            oo = outer.copy()
+            oo.update(hh.digest())
+            value = oo.digest()
+            blocks.append(value)
+        self.value = value
+        self._update(additional)
+        self.reseed_counter += 1
+        return ''.join(blocks)[:count]
+
+
+class reseed_policy:
+
+    """This decides when a DRBG must or should be reseeded.
+
+    max_bytes    reseed before more than this many bytes are output.
+    max_secs     reseed before output this many seconds after the last
+                 seed.
+    fresh_bits   reseed as soon as this many bits of fresh entropy have
+                 been collected, whether or not the limits above are near.
+
+    Any of these may be None to turn that rule off. When max_bytes or
+    max_secs is reached, output must stop until there is enough fresh
+    entropy to reseed.
+    """
+
+    def __init__(self, max_bytes=1024 * 1024, max_secs=60.0, fresh_bits=None):
+
+        self.max_bytes = max_bytes
+        self.max_secs = max_secs
+        self.fresh_bits = fresh_bits
+
+    def __str__(self):
+
+        return ('reseed policy: max_bytes=%s, max_secs=%s, fresh_bits=%s' %
+                (self.max_bytes, self.max_secs, self.fresh_bits))
+
+    def required(self, bytes_since_seed, secs_since_seed):
+
+        if self.max_bytes is not None and bytes_since_seed >= self.max_bytes:
+            return True
+        if self.max_secs is not None and secs_since_seed >= self.max_secs:
+            return True
+        return False
+
+    def wanted(self, fresh_bits):
+
+        return self.fresh_bits is not None and fresh_bits >= self.fresh_bits
+
+
+if __name__ == '__main__':
+
+    # Measure the output rate of a DRBG seeded from os.urandom.
+    import os
+    generator = hmac_drbg(os.urandom(SEED_BYTES), os.urandom(NONCE_BYTES))
+    start_time = time.time()
+    total = 0
+    while time.time() - start_time < 2.0:
+        total += len(generator.generate(MAX_BYTES_PER_REQUEST))
+    sys.stdout.write('%f bytes per second\n' %
+                     (total / (time.time() - start_time)))
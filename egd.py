@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# vim:set ft=python fileencoding=utf-8 sr et ts=4 sw=4 : See help 'modeline'
+"""Entropy pool and EGD protocol server.
+
+DESCRIPTION
+
+    This module keeps a bounded pool of entropy bytes and serves it to
+    local clients over a Unix domain socket using the request protocol of
+    the Entropy Gathering Daemon (EGD). Many programs, such as OpenSSL and
+    GnuPG, already know how to talk to an EGD socket.
+
+    The server runs a single epoll loop. Other file descriptors, such as
+    input devices that fill the pool, may be added to the same loop with
+    add_reader(), so no threads are needed. Bytes are added to the pool
+    with add_entropy().
+
+    The EGD requests are:
+
+        0x00                get the entropy level. The reply is the number
+                            of bits in the pool as a 4 byte big-endian
+                            unsigned int.
+        0x01 N              non-blocking read of up to N bytes. The reply
+                            is one byte giving the count of bytes that
+                            follow, which may be less than N or zero.
+        0x02 N              blocking read of N bytes. The reply is exactly
+                            N bytes, sent as they become available.
+        0x03 B1 B2 N DATA   write N bytes of entropy worth B1B2 bits. This
+                            server does not credit client data, so it is
+                            read and thrown away. There is no reply.
+        0x04                get the server process id. The reply is one
+                            byte giving the length of the pid string,
+                            followed by the string.
+
+AUTHOR
+
+    Noah Spurrier <noah@noah.org>
+
+LICENSE
+
+    This license is approved by the OSI and FSF as GPL-compatible.
+        http://opensource.org/licenses/isc-license.txt
+
+    Copyright (c) 2013, Noah Spurrier
+    PERMISSION TO USE, COPY, MODIFY, AND/OR DISTRIBUTE THIS SOFTWARE FOR ANY
+    PURPOSE WITH OR WITHOUT FEE IS HEREBY GRANTED, PROVIDED THAT THE ABOVE
+    COPYRIGHT NOTICE AND THIS PERMISSION NOTICE APPEAR IN ALL COPIES.
+    THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+    WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+    ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+    WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+    ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+    OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+VERSION
+
+    Version 1
+"""
+
+import os
+import sys
+import errno
+import select
+import socket
+import struct
+
+EGD_GET_LEVEL = 0x00
+EGD_READ_NONBLOCKING = 0x01
+EGD_READ_BLOCKING = 0x02
+EGD_WRITE_ENTROPY = 0x03
+EGD_GET_PID = 0x04
+
+
+class entropy_pool:
+
+    """This is a fixed size ring buffer of entropy bytes. When the pool is
+    full new bytes are thrown away and counted in dropped. Bytes are only
+    ever handed out once. """
+
+    def __init__(self, size=65536):
+
+        self.size = size
+        self.dropped = 0
+        self._ring = bytearray(size)
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+
+        return self._count
+
+    def __str__(self):
+
+        return ('pool: %d of %d bytes, %d bytes dropped' %
+                (self._count, self.size, self.dropped))
+
+    def add(self, data):
+
+        """This adds as much of data as fits and returns the number of
+        bytes added. """
+
+        room = self.size - self._count
+        if len(data) > room:
+            self.dropped += len(data) - room
+            data = data[:room]
+        end = (self._start + self._count) % self.size
+        first = min(len(data), self.size - end)
+        self._ring[end:end + first] = data[:first]
+        self._ring[:len(data) - first] = data[first:]
+        self._count += len(data)
+        return len(data)
+
+    def take(self, count):
+
+        """This removes and returns up to count bytes from the pool. """
+
+        count = min(count, self._count)
+        first = min(count, self.size - self._start)
+        data = (str(self._ring[self._start:self._start + first]) +
+                str(self._ring[:count - first]))
+        self._start = (self._start + count) % self.size
+        self._count -= count
+        return data
+
+
+class _client:
+
+    def __init__(self, sock):
+
+        self.sock = sock
+        self.inbuf = ''
+        self.outbuf = ''
+        self.blocking_wanted = 0
+
+
+class egd_server:
+
+    """This serves an entropy_pool to EGD clients on a Unix domain socket.
+    Call serve_forever() to run the epoll loop. Blocking read requests are
+    queued and filled in the order they arrive as add_entropy() adds bytes
+    to the pool. """
+
+    def __init__(self, path, pool=None):
+
+        if pool is None:
+            pool = entropy_pool()
+        self.path = path
+        self.pool = pool
+        self._clients = {}
+        self._waiting = []
+        self._readers = {}
+        self._epoll = select.epoll()
+        if os.path.exists(path):
+            os.unlink(path)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(path)
+        self._listener.listen(128)
+        self._listener.setblocking(False)
+        self._epoll.register(self._listener.fileno(), select.EPOLLIN)
+
+    def close(self):
+
+        for fd in self._clients.keys():
+            self._drop(fd)
+        self._epoll.close()
+        self._listener.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def add_reader(self, fd, callback):
+
+        """This calls callback() whenever fd is readable. """
+
+        self._readers[fd] = callback
+        self._epoll.register(fd, select.EPOLLIN)
+
+    def remove_reader(self, fd):
+
+        del self._readers[fd]
+        self._epoll.unregister(fd)
+
+    def add_entropy(self, data):
+
+        """This adds data to the pool and then fills any waiting blocking
+        reads. """
+
+        self.pool.add(data)
+        self._serve_waiting()
+
+    def serve_forever(self, timeout=-1, idle_callback=None):
+
+        while True:
+            self.run_once(timeout)
+            if idle_callback is not None:
+                idle_callback()
+
+    def run_once(self, timeout=-1):
+
+        try:
+            ready = self._epoll.poll(timeout)
+        except IOError, ee:
+            if ee.errno == errno.EINTR:
+                return
+            raise
+        for fd, eventmask in ready:
+            if fd == self._listener.fileno():
+                self._accept()
+            elif fd in self._readers:
+                self._readers[fd]()
+            elif fd in self._clients:
+                if eventmask & select.EPOLLIN:
+                    self._read_client(fd)
+                if fd in self._clients and eventmask & select.EPOLLOUT:
+                    self._flush_client(fd)
+                if fd in self._clients and eventmask & (select.EPOLLHUP |
+                                                        select.EPOLLERR):
+                    self._drop(fd)
+
+    def _accept(self):
+
+        while True:
+            try:
+                sock, address = self._listener.accept()
+            except socket.error, ee:
+                if ee.errno in (errno.EAGAIN, errno.EINTR):
+                    return
+                raise
+            sock.setblocking(False)
+            self._clients[sock.fileno()] = _client(sock)
+            self._epoll.register(sock.fileno(), select.EPOLLIN)
+
+    def _drop(self, fd):
+
+        client = self._clients.pop(fd)
+        if client in self._waiting:
+            self._waiting.remove(client)
+        self._epoll.unregister(fd)
+        client.sock.close()
+
+    def _read_client(self, fd):
+
+        client = self._clients[fd]
+        try:
+            data = client.sock.recv(4096)
+        except socket.error, ee:
+            if ee.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            data = ''
+        if not data:
+            self._drop(fd)
+            return
+        client.inbuf += data
+        self._handle_requests(client)
+        if fd in self._clients:
+            self._flush_client(fd)
+
+    def _handle_requests(self, client):
+
+        # Requests from one client are answered in order, so nothing more
+        # is parsed while a blocking read is still waiting for bytes.
+        while client.inbuf and not client.blocking_wanted:
+            command = ord(client.inbuf[0])
+            if command == EGD_GET_LEVEL:
+                client.outbuf += struct.pack('>I', len(self.pool) * 8)
+                used = 1
+            elif command == EGD_GET_PID:
+                pid = str(os.getpid())
+                client.outbuf += chr(len(pid)) + pid
+                used = 1
+            elif command in (EGD_READ_NONBLOCKING, EGD_READ_BLOCKING):
+                if len(client.inbuf) < 2:
+                    return
+                count = ord(client.inbuf[1])
+                if command == EGD_READ_NONBLOCKING:
+                    data = self.pool.take(count)
+                    client.outbuf += chr(len(data)) + data
+                else:
+                    client.blocking_wanted = count
+                    self._waiting.append(client)
+                used = 2
+            elif command == EGD_WRITE_ENTROPY:
+                if len(client.inbuf) < 4:
+                    return
+                used = 4 + ord(client.inbuf[3])
+                if len(client.inbuf) < used:
+                    return
+            else:
+                # Unknown request. There is no way to resync the stream.
+                self._drop(client.sock.fileno())
+                return
+            client.inbuf = client.inbuf[used:]
+        if client.blocking_wanted:
+            self._serve_waiting()
+
+    def _serve_waiting(self):
+
+        while self._waiting and len(self.pool):
+            client = self._waiting[0]
+            data = self.pool.take(client.blocking_wanted)
+            client.blocking_wanted -= len(data)
+            client.outbuf += data
+            if not client.blocking_wanted:
+                self._waiting.pop(0)
+            fd = client.sock.fileno()
+            self._flush_client(fd)
+            if fd in self._clients and not client.blocking_wanted:
+                self._handle_requests(client)
+                self._flush_client(fd)
+
+    def _flush_client(self, fd):
+
+        client = self._clients[fd]
+        if client.outbuf:
+            try:
+                sent = client.sock.send(client.outbuf)
+            except socket.error, ee:
+                if ee.errno in (errno.EAGAIN, errno.EINTR):
+                    sent = 0
+                else:
+                    self._drop(fd)
+                    return
+            client.outbuf = client.outbuf[sent:]
+        if client.outbuf:
+            self._epoll.modify(fd, select.EPOLLIN | select.EPOLLOUT)
+        else:
+            self._epoll.modify(fd, select.EPOLLIN)
+
+
+class egd_client:
+
+    """This is a minimal blocking client for an EGD socket. """
+
+    def __init__(self, path):
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+
+    def close(self):
+
+        self.sock.close()
+
+    def _recv_exactly(self, count):
+
+        data = ''
+        while len(data) < count:
+            chunk = self.sock.recv(count - len(data))
+            if not chunk:
+                raise EOFError('EGD server closed the connection')
+            data += chunk
+        return data
+
+    def entropy_level(self):
+
+        self.sock.sendall(chr(EGD_GET_LEVEL))
+        return struct.unpack('>I', self._recv_exactly(4))[0]
+
+    def read_nonblocking(self, count):
+
+        self.sock.sendall(chr(EGD_READ_NONBLOCKING) + chr(count))
+        return self._recv_exactly(ord(self._recv_exactly(1)))
+
+    def read_blocking(self, count):
+
+        self.sock.sendall(chr(EGD_READ_BLOCKING) + chr(count))
+        return self._recv_exactly(count)
+
+    def pid(self):
+
+        self.sock.sendall(chr(EGD_GET_PID))
+        return int(self._recv_exactly(ord(self._recv_exactly(1))))
+
+
+if __name__ == '__main__':
+
+    # Serve bytes from /dev/urandom. This is only useful for testing clients.
+    if len(sys.argv) < 2:
+        sys.stderr.write('usage: egd.py SOCKET_PATH\n')
+        sys.exit(1)
+    server = egd_server(sys.argv[1])
+    try:
+        server.serve_forever(0.1, lambda: server.add_entropy(
+            os.urandom(server.pool.size - len(server.pool))))
+    finally:
+        server.close()
@@ -3,15 +3,66 @@
 '''
 SYNOPSIS
 
-    entropy_calc.py [--blocksize=N] [-h,--help] [-v,--verbose] [--version]
+    entropy_calc.py [--blocksize=N] [--jobs=N] [--estimators=LIST]
+        [-h,--help] [-v,--verbose] [--version] [FILE...]
 
 DESCRIPTION
 
-    This script calculates the Shannon entropy over data read from stdin.
-    Entropy is calculated for blocks of data. The entropy is printed for each
-    block. The default blocksize is 0. Setting the blocksize to 0 will read
-    the stream until end of file and calculate the entropy for the entire
-    dataset.
+    This script calculates the Shannon entropy over data read from stdin,
+    or from each file given. Entropy is calculated for blocks of data. The
+    entropy is printed for each block. The default blocksize is 0. Setting
+    the blocksize to 0 will read the stream until end of file and calculate
+    the entropy for the entire dataset.
+
+    Only a histogram of the 256 byte values is kept, so memory use stays
+    the same however large the input is. The histogram is counted with
+    numpy if it is installed, or with str.count() if not.
+
+    With --jobs the files are memory-mapped and split into chunks, which
+    are counted by a pool of worker processes. All the files are worked on
+    at once. The chunk histograms are added up exactly, so the output is
+    the same as without --jobs. --jobs has no effect on stdin.
+
+    Shannon entropy overstates the entropy that may safely be credited to
+    a source. --estimators selects other estimates, which give the
+    min-entropy in bits per byte as described in NIST SP 800-90B section
+    6.3. The estimates chosen are printed on one line per block, in the
+    order given. The estimators are:
+
+        shannon       Shannon entropy of the byte histogram (the default).
+        mcv           most common value, from the byte histogram.
+        collision     mean distance between repeated bits.
+        markov        most likely 128 bit sequence of a first order
+                      Markov model of the bits.
+        compression   mean log distance between repeated 6 bit symbols.
+        tuple         most common tuples of 1 to 16 bytes.
+
+    The statistics of the ent program can be chosen as well:
+
+        chisquare     chi-square of the byte histogram against a uniform
+                      distribution, with 255 degrees of freedom.
+        chisquare_p   chance that random data would give a larger
+                      chi-square, from 0 to 1.
+        mean          arithmetic mean of the bytes (127.5 is random).
+        pi            Monte Carlo value of pi from the 6 byte groups of
+                      the data taken as points in a square (3.14159...
+                      is random).
+        serial        serial correlation of each byte with the next, the
+                      last byte wrapping around to the first (0.0 is
+                      random, nan if all the bytes are equal).
+
+    'ent' stands for shannon followed by these, in the order ent prints
+    them. They are counted in the same pass as the histogram, with bulk
+    operations on each chunk, and add up exactly over the chunks of
+    --jobs.
+
+    The collision, Markov and compression estimates are taken over the
+    bits of the data and multiplied by 8. All but tuple are worked out in
+    one pass with running counts, so their memory use stays the same.
+    The tuple estimate keeps each block in memory, so it needs a
+    --blocksize and 'all' leaves it out. With --blocksize=0, --jobs only
+    splits up the shannon, mcv and ent estimates; with others the files
+    are read serially.
 
     This docstring will be printed by the script if there is an error
     or if the user requests help (-h or --help).
@@ -40,6 +91,13 @@ EXAMPLES
         7.81897457133
         7.80212491335
 
+        $ ./entropy_calc.py --blocksize=65536 --estimators=mcv capture.bin
+        7.62536914811
+        7.63150371268
+
+        $ ./entropy_calc.py --estimators=chisquare_p,pi,serial capture.bin
+        0.506197123432 3.14193893218 -0.000139838066637
+
 EXIT STATUS
 
     This exits with status 0 on success and 1 otherwise.
@@ -84,7 +142,20 @@ import time
 import logging
 import math
 import random
+import re
+import collections
+import operator
+import itertools
+import functools
+import array
+import mmap
+import multiprocessing
 import fileinput
+try:
+    import numpy
+    HAS_NUMPY_MODULE = True
+except ImportError:
+    HAS_NUMPY_MODULE = False
 
 logging.basicConfig(format='%(asctime)s %(message)s')
 logger = logging.getLogger(__name__)
@@ -100,38 +171,770 @@ if os.getenv('PYTHONLOGGING') in logging._levelNames:
 #    pass
 #atexit.register(readline.write_history_file, histfile)
 
+# Chunk size used when the whole stream is one block (--blocksize=0).
+READ_CHUNK_SIZE = 1024 * 1024
+# Size of the pieces of a file handed to each worker process by --jobs.
+PARALLEL_CHUNK_SIZE = 4 * 1024 * 1024
+BYTE_CHARS = [chr(nn) for nn in range(256)]
+SMALL_DATA_SIZE = 2048
+
+# The statistics printed by the ent program, other than its entropy.
+ENT_STATISTICS = ('chisquare', 'chisquare_p', 'mean', 'pi', 'serial')
+ESTIMATORS = ('shannon', 'mcv', 'collision', 'markov', 'compression',
+              'tuple') + ENT_STATISTICS
+ENT_ESTIMATORS = ('shannon',) + ENT_STATISTICS
+# These only need the byte histogram, or sums that merge() can add up, so
+# --jobs can add up chunks of them.
+HISTOGRAM_ESTIMATORS = ('shannon', 'mcv')
+MERGEABLE_ESTIMATORS = HISTOGRAM_ESTIMATORS + ENT_STATISTICS
+# These work on the data as a string of bits, most significant bit first.
+BIT_ESTIMATORS = ('collision', 'markov')
+# The upper bound of a 99% confidence interval, as in SP 800-90B.
+Z_ALPHA = 2.576
+BYTE_BITS = [format(nn, '08b') for nn in range(256)]
+# Maps the bytes '\x00' and '\x01' from numpy.unpackbits() to '0' and '1'.
+UNPACKED_BITS = '01' + ''.join(BYTE_CHARS[2:])
+# The collision search steps through the bits until a value repeats. With
+# two values that is always after 2 or 3 bits.
+COLLISION_RE = re.compile('00|11|...')
+# The compression estimate uses 6 bit symbols, a dictionary of the first
+# 1000 symbols and the constant c from SP 800-90B section 6.3.4.
+COMPRESSION_BITS = 6
+COMPRESSION_DICTIONARY = 1000
+COMPRESSION_C = 0.5907
+# Every 3 bytes are 4 symbols. These tables take the bits of each symbol
+# from the byte or bytes it is in, already shifted into place.
+SYMBOL_BYTES = 3
+SYMBOL_TABLES = [''.join([chr(shift(nn)) for nn in range(256)])
+                 for shift in (lambda nn: nn >> 2,
+                               lambda nn: (nn & 3) << 4,
+                               lambda nn: nn >> 4,
+                               lambda nn: (nn & 15) << 2,
+                               lambda nn: nn >> 6,
+                               lambda nn: nn & 63)]
+# log2(distance) and its square for the distances of 1 to 4096 symbols, by
+# the number of other symbols between.
+COMPRESSION_TABLE_SIZE = 4096
+LOG_DISTANCES = [math.log(nn + 1, 2) for nn in range(COMPRESSION_TABLE_SIZE)]
+LOG_SQUARE_DISTANCES = [log_distance * log_distance
+                        for log_distance in LOG_DISTANCES]
+# These keep the whole block, so they need a blocksize.
+BLOCK_ESTIMATORS = ('tuple',)
+# The t-tuple estimate uses tuples that occur at least this many times.
+TUPLE_CUTOFF = 35
+TUPLE_MAX_SIZE = 16
+# ent takes each 6 bytes as the x and y of a point, 24 bits each, and
+# counts the points inside the circle that touches the sides of the square.
+MONTE_CARLO_BYTES = 6
+MONTE_CARLO_RADIUS_SQUARED = ((1 << 24) - 1) ** 2
+
+
+def byte_histogram(data):
+
+    """This returns a list of 256 counts, one for each byte value in the
+    string data. """
+
+    if HAS_NUMPY_MODULE:
+        return numpy.bincount(numpy.frombuffer(data, dtype=numpy.uint8),
+                              minlength=256).tolist()
+    if len(data) < SMALL_DATA_SIZE:
+        # One str.count() per byte value costs more than a loop here.
+        counts = [0] * 256
+        for value in map(ord, data):
+            counts[value] += 1
+        return counts
+    return map(data.count, BYTE_CHARS)
+
+
+def byte_bits(data):
+
+    """This returns the string data as a string of '0' and '1'
+    characters, most significant bit first. """
+
+    if HAS_NUMPY_MODULE:
+        return numpy.unpackbits(numpy.frombuffer(
+            data, dtype=numpy.uint8)).tostring().translate(UNPACKED_BITS)
+    return ''.join(map(BYTE_BITS.__getitem__, map(ord, data)))
+
+
+def six_bit_symbols(data):
+
+    """This returns the string data, whose length must be a multiple of
+    SYMBOL_BYTES, as a string of one character from '\\x00' to '\\x3f' for
+    every 6 bits, most significant bits first. """
+
+    if HAS_NUMPY_MODULE:
+        values = numpy.frombuffer(data, dtype=numpy.uint8).reshape(
+            -1, SYMBOL_BYTES)
+        symbols = numpy.empty((len(values), 4), dtype=numpy.uint8)
+        symbols[:, 0] = values[:, 0] >> 2
+        symbols[:, 1] = ((values[:, 0] & 3) << 4) | (values[:, 1] >> 4)
+        symbols[:, 2] = ((values[:, 1] & 15) << 2) | (values[:, 2] >> 6)
+        symbols[:, 3] = values[:, 2] & 63
+        return symbols.tostring()
+    first = data[0::SYMBOL_BYTES]
+    second = data[1::SYMBOL_BYTES]
+    third = data[2::SYMBOL_BYTES]
+    parts = [bytearray(part.translate(table)) for part, table in
+             zip((first, first, second, second, third, third), SYMBOL_TABLES)]
+    symbols = bytearray(len(first) * 4)
+    symbols[0::4] = parts[0]
+    symbols[1::4] = bytearray(map(operator.or_, parts[1], parts[2]))
+    symbols[2::4] = bytearray(map(operator.or_, parts[3], parts[4]))
+    symbols[3::4] = parts[5]
+    return str(symbols)
+
+
+def upper_bound(pp, samples):
+
+    """This returns the upper bound of the 99% confidence interval of the
+    probability pp estimated from a number of samples. """
+
+    if samples < 2:
+        return 1.0
+    return min(1.0, pp + Z_ALPHA * math.sqrt(pp * (1.0 - pp) /
+                                             (samples - 1)))
+
+
+def chi_square_p(chi, freedom):
+
+    """This returns the chance that a chi-square with freedom degrees of
+    freedom is larger than chi. That is the regularized upper incomplete
+    gamma function Q(freedom / 2, chi / 2), worked out with its series
+    below the mean and its continued fraction above, as in Numerical
+    Recipes. """
+
+    aa = freedom / 2.0
+    xx = chi / 2.0
+    if xx <= 0.0:
+        return 1.0
+    front = math.exp(aa * math.log(xx) - xx - math.lgamma(aa))
+    tiny = 1e-300
+    if xx < aa + 1.0:
+        term = total = 1.0 / aa
+        nn = aa
+        while abs(term) > abs(total) * 1e-15:
+            nn += 1.0
+            term *= xx / nn
+            total += term
+        return max(0.0, 1.0 - front * total)
+    bb = xx + 1.0 - aa
+    cc = 1.0 / tiny
+    dd = 1.0 / bb
+    hh = dd
+    for ii in xrange(1, 1000):
+        an = -ii * (ii - aa)
+        bb += 2.0
+        dd = an * dd + bb
+        if abs(dd) < tiny:
+            dd = tiny
+        cc = bb + an / cc
+        if abs(cc) < tiny:
+            cc = tiny
+        dd = 1.0 / dd
+        delta = dd * cc
+        hh *= delta
+        if abs(delta - 1.0) < 1e-15:
+            break
+    return front * hh
+
+
+def serial_products(data):
+
+    """This returns the sum of the products of each byte of the string
+    data with the byte after it. """
+
+    if HAS_NUMPY_MODULE:
+        values = numpy.frombuffer(data, dtype=numpy.uint8).astype(
+            numpy.int64)
+        return int(numpy.dot(values[:-1], values[1:]))
+    values = bytearray(data)
+    return sum(itertools.imap(operator.mul, values,
+                              itertools.islice(values, 1, None)))
+
+
+def monte_carlo_inside(data):
+
+    """This returns the number of the MONTE_CARLO_BYTES groups of the
+    string data, whose length must be a multiple of MONTE_CARLO_BYTES,
+    that are points inside the circle. """
+
+    if HAS_NUMPY_MODULE:
+        values = numpy.frombuffer(data, dtype=numpy.uint8).astype(
+            numpy.int64).reshape(-1, MONTE_CARLO_BYTES)
+        xx = (values[:, 0] << 16) | (values[:, 1] << 8) | values[:, 2]
+        yy = (values[:, 3] << 16) | (values[:, 4] << 8) | values[:, 5]
+        return int(numpy.count_nonzero(
+            xx * xx + yy * yy <= MONTE_CARLO_RADIUS_SQUARED))
+    # Spread each 3 byte coordinate into a big-endian 32 bit word, so that
+    # array can read them all at once.
+    words = bytearray(len(data) // 3 * 4)
+    for word_offset, offset in ((1, 0), (2, 1), (3, 2), (5, 3), (6, 4),
+                                (7, 5)):
+        words[word_offset::8] = data[offset::MONTE_CARLO_BYTES]
+    coordinates = array.array('I', str(words))
+    if sys.byteorder == 'little':
+        coordinates.byteswap()
+    xx = coordinates[0::2]
+    yy = coordinates[1::2]
+    distances = map(operator.add, map(operator.mul, xx, xx),
+                    map(operator.mul, yy, yy))
+    return len(filter(functools.partial(operator.ge,
+                                        MONTE_CARLO_RADIUS_SQUARED),
+                      distances))
+
+
+def min_entropy(pp):
+
+    if pp <= 0.0:
+        return 0.0
+    return -math.log(pp, 2) + 0.0
+
+
 class entropy_calc:
 
-    def __init__(self):
+    """This keeps a histogram of the byte values passed to update(). The
+    histogram is a fixed list of 256 counts, so memory does not grow with
+    the data. Call reset() to start a new block.
+
+    estimators names the entropy estimates that will be asked for. Those
+    other than Shannon entropy are the SP 800-90B estimates, which give
+    min-entropy in bits per byte. They keep a few running sums next to the
+    histogram, except for 'tuple', which must keep the whole block. The
+    ENT_STATISTICS also keep running sums, which partial() returns and
+    merge() adds up, so chunks of a stream can be counted apart. """
+
+    def __init__(self, estimators=('shannon',)):
+
+        for name in estimators:
+            if name not in ESTIMATORS:
+                raise ValueError('unknown estimator: %s' % name)
+        self.estimators = tuple(estimators)
+        self.reset()
+
+    def reset(self):
 
-        self.block = []
+        self.counts = [0] * 256
+        self.length = 0
+        # Markov: the count of 1 bits and of 01 and 10 pairs.
+        self._last_bit = ''
+        self._ones = 0
+        self._pairs_01 = 0
+        self._pairs_10 = 0
+        # Collision: the bits not yet searched and the number of
+        # collisions found after 2 and after 3 bits.
+        self._collision_rest = ''
+        self._collisions_2 = 0
+        self._collisions_3 = 0
+        # Compression: the bytes of the next symbols, the number of
+        # symbols, the last index of each symbol and the sums of
+        # log2(distance).
+        self._symbol_rest = ''
+        self._symbols = 0
+        self._symbol_index = [0] * (1 << COMPRESSION_BITS)
+        self._log_sum = 0.0
+        self._log_square_sum = 0.0
+        self._blocks = []
+        # ent: the first and last bytes and the sum of the products of
+        # neighbouring bytes, and the Monte Carlo bytes not yet in a point,
+        # the points and the points inside the circle.
+        self._first_byte = None
+        self._last_byte = None
+        self._serial_sum = 0
+        self._monte_rest = ''
+        self._points = 0
+        self._inside = 0
 
     def update(self, vv):
 
-        # FIXME raise exception if vv cannot be added to block array.
-        if not hasattr(vv, "__iter__"):
-            if type(vv) is type(''):
-                for cc in vv:
-                    self.block.extend([cc])
+        """This adds vv to the histogram. vv may be a string of bytes, a
+        byte value from 0 to 255, or an iterable of byte values. """
+
+        if isinstance(vv, (int, long)):
+            vv = chr(vv)
+        elif not isinstance(vv, str):
+            if not hasattr(vv, '__iter__'):
+                raise TypeError('cannot add %r to the histogram' % (vv,))
+            vv = ''.join([chr(value) if isinstance(value, (int, long))
+                          else value for value in vv])
+        if not vv:
+            return
+        self.counts = map(operator.add, self.counts, byte_histogram(vv))
+        self.length += len(vv)
+        estimators = self.estimators
+        if 'serial' in estimators:
+            self._update_serial(vv)
+        if 'pi' in estimators:
+            self._update_monte_carlo(vv)
+        if 'tuple' in estimators:
+            self._blocks.append(vv)
+        if 'compression' in estimators:
+            self._update_compression(vv)
+        for name in BIT_ESTIMATORS:
+            if name in estimators:
+                break
         else:
-            self.block.extend([vv])
+            return
+        bits = byte_bits(vv)
+        if 'markov' in estimators:
+            self._ones += bits.count('1')
+            self._pairs_01 += bits.count('01')
+            self._pairs_10 += bits.count('10')
+            boundary = self._last_bit + bits[0]
+            self._pairs_01 += boundary == '01'
+            self._pairs_10 += boundary == '10'
+            self._last_bit = bits[-1]
+        if 'collision' in estimators:
+            bits_searched = self._collision_rest + bits
+            rest, found = COLLISION_RE.subn('', bits_searched)
+            # Every collision is 2 or 3 bits long.
+            long_found = len(bits_searched) - len(rest) - 2 * found
+            self._collisions_2 += found - long_found
+            self._collisions_3 += long_found
+            self._collision_rest = rest
 
-    def entropy_shannon(self):
+    def _update_serial(self, data):
 
-        histogram = {}
-        for vv in self.block:
-            if vv in histogram:
-                histogram[vv] += 1
+        if self._last_byte is None:
+            self._first_byte = ord(data[0])
+        else:
+            self._serial_sum += self._last_byte * ord(data[0])
+        self._serial_sum += serial_products(data)
+        self._last_byte = ord(data[-1])
+
+    def _update_monte_carlo(self, data):
+
+        data = self._monte_rest + data
+        end = len(data) - len(data) % MONTE_CARLO_BYTES
+        self._monte_rest = data[end:]
+        self._points += end // MONTE_CARLO_BYTES
+        self._inside += monte_carlo_inside(data[:end])
+
+    def partial(self):
+
+        """This returns the histogram, the length and the running sums of
+        the ENT_STATISTICS, for merge(). """
+
+        return (self.counts, self.length, self._first_byte,
+                self._last_byte, self._serial_sum, self._points,
+                self._inside)
+
+    def merge(self, partial):
+
+        """This adds the partial() of the chunk of data that comes after
+        the data counted so far. Unless it is the last chunk, its length
+        must be a multiple of MONTE_CARLO_BYTES for the Monte Carlo
+        points to be the same as if the data were counted in one piece.
+        """
+
+        (counts, length, first_byte, last_byte, serial_sum, points,
+         inside) = partial
+        self.counts = map(operator.add, self.counts, counts)
+        self.length += length
+        if first_byte is not None:
+            if self._last_byte is None:
+                self._first_byte = first_byte
             else:
-                histogram[vv] = 1
-        length = float(len(self.block))
+                self._serial_sum += self._last_byte * first_byte
+            self._last_byte = last_byte
+        self._serial_sum += serial_sum
+        self._points += points
+        self._inside += inside
+
+    def _update_compression(self, data):
+
+        data = self._symbol_rest + data
+        end = len(data) - len(data) % SYMBOL_BYTES
+        self._symbol_rest = data[end:]
+        self._symbols, log_sum, log_square_sum = _compression_sums(
+            six_bit_symbols(data[:end]), self._symbols, self._symbol_index)
+        self._log_sum += log_sum
+        self._log_square_sum += log_square_sum
+
+    def estimate(self, name):
+
+        """This returns the estimate called name, from ESTIMATORS. """
+
+        if name in ENT_STATISTICS:
+            return getattr(self, 'ent_' + name)()
+        return getattr(self, 'entropy_' + name)()
+
+    def entropy_shannon(self):
+
+        if self.length == 0:
+            return 0.0
+        length = float(self.length)
         ee = 0.0
-        for count in histogram.values():
-            cl = float(count/length)
+        for count in filter(None, self.counts):
+            cl = count / length
             ee += cl * math.log(cl, 2)
         # Add zero to eliminate negative zeros (an IEEE quirk).
         return -ee + 0.0
 
+    def entropy_mcv(self):
+
+        """This returns the most common value estimate of min-entropy in
+        bits per byte (SP 800-90B section 6.3.1). """
+
+        if self.length == 0:
+            return 0.0
+        return min_entropy(upper_bound(max(self.counts) / float(self.length),
+                                       self.length))
+
+    def entropy_collision(self):
+
+        """This returns the collision estimate of min-entropy in bits per
+        byte (SP 800-90B section 6.3.2). It is 8 times the estimate for
+        each bit. """
+
+        found = self._collisions_2 + self._collisions_3
+        if found < 2:
+            return 0.0
+        mean = (2.0 * self._collisions_2 + 3.0 * self._collisions_3) / found
+        variance = (self._collisions_2 * (2.0 - mean) ** 2 +
+                    self._collisions_3 * (3.0 - mean) ** 2) / (found - 1)
+        mean -= Z_ALPHA * math.sqrt(variance / found)
+        # The expected distance to a collision is 2 + 2 p - 2 p ** 2, where
+        # p is the probability of the more likely bit. Solve for p.
+        if mean >= 2.5:
+            pp = 0.5
+        elif mean <= 2.0:
+            pp = 1.0
+        else:
+            pp = (1.0 + math.sqrt(5.0 - 2.0 * mean)) / 2.0
+        return 8 * min_entropy(pp)
+
+    def entropy_markov(self):
+
+        """This returns the Markov estimate of min-entropy in bits per
+        byte (SP 800-90B section 6.3.3). It is 8 times the estimate for
+        each bit, from the most likely of the 128 bit sequences. """
+
+        bits = self.length * 8
+        if bits < 2:
+            return 0.0
+        ones = self._ones
+        zeros = bits - ones
+        # Every bit but the last is the first of a pair.
+        pairs_00 = zeros - (self._last_bit == '0') - self._pairs_01
+        pairs_11 = ones - (self._last_bit == '1') - self._pairs_10
+        log_0 = _log2(zeros / float(bits))
+        log_1 = _log2(ones / float(bits))
+        log_00 = _log2(_ratio(pairs_00, pairs_00 + self._pairs_01))
+        log_01 = _log2(_ratio(self._pairs_01, pairs_00 + self._pairs_01))
+        log_10 = _log2(_ratio(self._pairs_10, self._pairs_10 + pairs_11))
+        log_11 = _log2(_ratio(pairs_11, self._pairs_10 + pairs_11))
+        log_p_max = max(log_0 + 127 * log_00,
+                        log_0 + 64 * log_01 + 63 * log_10,
+                        log_0 + log_01 + 126 * log_11,
+                        log_1 + log_10 + 126 * log_00,
+                        log_1 + 64 * log_10 + 63 * log_01,
+                        log_1 + 127 * log_11)
+        return 8 * min(1.0, -log_p_max / 128.0) + 0.0
+
+    def entropy_compression(self):
+
+        """This returns the compression estimate of min-entropy in bits
+        per byte (SP 800-90B section 6.3.4), from the mean log distance
+        between repeats of each 6 bit symbol. """
+
+        symbols = self._symbols
+        log_sum = self._log_sum
+        log_square_sum = self._log_square_sum
+        rest = self._symbol_rest
+        if rest:
+            # The last 1 or 2 bytes hold as many whole symbols.
+            tail = six_bit_symbols(rest + '\0' * (SYMBOL_BYTES - len(rest)))
+            symbols, tail_sum, tail_square_sum = _compression_sums(
+                tail[:len(rest)], symbols, list(self._symbol_index))
+            log_sum += tail_sum
+            log_square_sum += tail_square_sum
+        tested = symbols - COMPRESSION_DICTIONARY
+        if tested < 2:
+            return 0.0
+        mean = log_sum / tested
+        variance = max(0.0, log_square_sum / (tested - 1) - mean ** 2)
+        mean -= Z_ALPHA * COMPRESSION_C * math.sqrt(variance / tested)
+        low = 1.0 / (1 << COMPRESSION_BITS)
+        if mean >= _compression_mean(low, symbols):
+            pp = low
+        else:
+            # The expected mean falls as p rises, down to 0 at p = 1.
+            high = 1.0
+            while high - low > 1e-9:
+                pp = (low + high) / 2.0
+                if _compression_mean(pp, symbols) > mean:
+                    low = pp
+                else:
+                    high = pp
+            pp = (low + high) / 2.0
+        return 8 * min_entropy(pp) / COMPRESSION_BITS
+
+    def entropy_tuple(self):
+
+        """This returns the t-tuple estimate of min-entropy in bits per
+        byte (SP 800-90B section 6.3.5). It counts the tuples of 1, 2, ...
+        bytes for as long as the most common one occurs at least
+        TUPLE_CUTOFF times, up to TUPLE_MAX_SIZE bytes. A tuple can only
+        be that common if its prefix is, so each size only looks at the
+        places where a common tuple of the size before starts. """
+
+        length = self.length
+        if length == 0:
+            return 0.0
+        data = ''.join(self._blocks)
+        self._blocks = [data]
+        p_max = max(self.counts) / float(length)
+        if HAS_NUMPY_MODULE:
+            counts = _tuple_most_numpy(data)
+        else:
+            counts = _tuple_most(data)
+        for size, most in enumerate(counts, 2):
+            p_max = max(p_max, (most / float(length - size + 1)) **
+                        (1.0 / size))
+        return min_entropy(upper_bound(p_max, length))
+
+    def ent_chisquare(self):
+
+        """This returns the chi-square of the byte histogram against a
+        uniform distribution, as ent prints it. """
+
+        if self.length == 0:
+            return 0.0
+        expected = self.length / 256.0
+        return sum([(count - expected) ** 2 for count in self.counts]) / \
+            expected
+
+    def ent_chisquare_p(self):
+
+        return chi_square_p(self.ent_chisquare(), 255)
+
+    def ent_mean(self):
+
+        if self.length == 0:
+            return 0.0
+        return (sum(map(operator.mul, self.counts, range(256))) /
+                float(self.length))
+
+    def ent_pi(self):
+
+        """This returns the Monte Carlo value of pi, four times the part
+        of the points that are inside the circle. """
+
+        if self._points == 0:
+            return 0.0
+        return 4.0 * self._inside / self._points
+
+    def ent_serial(self):
+
+        """This returns the serial correlation coefficient of each byte
+        with the next, with the last byte followed by the first, as ent
+        works it out. It is nan if every byte is the same. """
+
+        length = self.length
+        if length == 0:
+            return 0.0
+        total = sum(map(operator.mul, self.counts, range(256)))
+        square_total = sum(map(operator.mul, self.counts,
+                               [nn * nn for nn in range(256)]))
+        products = self._serial_sum + self._last_byte * self._first_byte
+        denominator = length * square_total - total * total
+        if denominator == 0:
+            return float('nan')
+        return (length * products - total * total) / float(denominator)
+
+
+def _tuple_most(data):
+
+    """This returns the count of the most common tuple of each size from 2
+    bytes up, for as long as it is at least TUPLE_CUTOFF. """
+
+    length = len(data)
+    results = []
+    positions = xrange(length - 1)
+    size = 2
+    while positions and size <= TUPLE_MAX_SIZE:
+        counts = collections.defaultdict(int)
+        for nn in positions:
+            counts[data[nn:nn + size]] += 1
+        most = max(counts.itervalues())
+        if most < TUPLE_CUTOFF:
+            break
+        results.append(most)
+        common = set([key for key, count in counts.iteritems()
+                      if count >= TUPLE_CUTOFF])
+        positions = [nn for nn in positions if nn + size < length and
+                     data[nn:nn + size] in common]
+        size += 1
+    return results
+
+
+def _tuple_most_numpy(data):
+
+    """This is _tuple_most() with numpy. Each place is given the number of
+    its tuple among the distinct tuples of that size, so a tuple one byte
+    longer is that number times 256 plus the next byte, and every size is
+    counted with one numpy.unique(). """
+
+    length = len(data)
+    results = []
+    values = numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.int64)
+    positions = numpy.arange(length - 1)
+    tuples = values[:-1]
+    size = 2
+    while positions.size and size <= TUPLE_MAX_SIZE:
+        keys = tuples * 256 + values[positions + size - 1]
+        unique, tuples, counts = numpy.unique(keys, return_inverse=True,
+                                              return_counts=True)
+        most = int(counts.max())
+        if most < TUPLE_CUTOFF:
+            break
+        results.append(most)
+        keep = (counts[tuples] >= TUPLE_CUTOFF) & (positions + size < length)
+        positions = positions[keep]
+        tuples = tuples[keep]
+        size += 1
+    return results
+
+
+def _ratio(count, total):
+
+    if total == 0:
+        return 0.0
+    return count / float(total)
+
+
+def _log2(pp):
+
+    if pp <= 0.0:
+        return float('-inf')
+    return math.log(pp, 2)
+
+
+def _compression_sums(symbols, index, last_index):
+
+    """This adds a string of symbols from six_bit_symbols() to the
+    compression estimate, after the first index symbols of the stream.
+    last_index is the list of the index, from 1, where each symbol was
+    last seen, and is updated. This returns the new index and the sums of
+    log2(distance) and of its square over the symbols after the
+    dictionary. """
+
+    if index < COMPRESSION_DICTIONARY:
+        # The first symbols only fill the dictionary.
+        filling = symbols[:COMPRESSION_DICTIONARY - index]
+        symbols = symbols[len(filling):]
+        for symbol in map(ord, filling):
+            index += 1
+            last_index[symbol] = index
+    if not symbols:
+        return index, 0.0, 0.0
+    if HAS_NUMPY_MODULE:
+        return _compression_sums_numpy(symbols, index, last_index)
+    log_2 = math.log(2)
+    log_sum = 0.0
+    log_square_sum = 0.0
+    for symbol in xrange(1 << COMPRESSION_BITS):
+        # Split on the symbol, the runs of other symbols between its
+        # repeats are each a distance less one. The first is counted from
+        # where it was last seen.
+        runs = symbols.split(BYTE_CHARS[symbol])
+        if len(runs) == 1:
+            continue
+        log_distance = math.log(index + len(runs[0]) + 1 -
+                                last_index[symbol]) / log_2
+        log_sum += log_distance
+        log_square_sum += log_distance * log_distance
+        last_index[symbol] = index + len(symbols) - len(runs[-1])
+        lengths = map(len, runs[1:-1])
+        if lengths and max(lengths) < COMPRESSION_TABLE_SIZE:
+            log_sum += sum(map(LOG_DISTANCES.__getitem__, lengths))
+            log_square_sum += sum(map(LOG_SQUARE_DISTANCES.__getitem__,
+                                      lengths))
+        elif lengths:
+            logs = map(math.log, map(operator.add, lengths,
+                                     itertools.repeat(1, len(lengths))))
+            log_sum += sum(logs) / log_2
+            log_square_sum += sum(map(operator.mul, logs, logs)) / \
+                (log_2 * log_2)
+    return index + len(symbols), log_sum, log_square_sum
+
+
+def _compression_sums_numpy(symbols, index, last_index):
+
+    # Sort the places of the symbols by symbol, keeping their order, so
+    # that each distance is from the place before in the same group.
+    values = numpy.frombuffer(symbols, dtype=numpy.uint8)
+    order = numpy.argsort(values, kind='mergesort')
+    places = order + (index + 1)
+    grouped = values[order]
+    firsts = numpy.ones(len(grouped), dtype=bool)
+    firsts[1:] = grouped[1:] != grouped[:-1]
+    lasts = numpy.ones(len(grouped), dtype=bool)
+    lasts[:-1] = firsts[1:]
+    before = numpy.empty(len(places), dtype=places.dtype)
+    before[1:] = places[:-1]
+    before[firsts] = numpy.array(last_index)[grouped[firsts]]
+    log_distances = numpy.log2(places - before)
+    for symbol, place in zip(grouped[lasts].tolist(),
+                             places[lasts].tolist()):
+        last_index[symbol] = place
+    return (index + len(symbols), float(log_distances.sum()),
+            float(numpy.dot(log_distances, log_distances)))
+
+
+def _compression_mean(pp, symbols):
+
+    """This returns the expected mean log2 distance of the compression
+    estimate when one symbol has the probability pp and the others share
+    the rest evenly. """
+
+    others = (1 << COMPRESSION_BITS) - 1
+    return (_compression_g(pp, symbols) +
+            others * _compression_g((1.0 - pp) / others, symbols))
+
+
+def _compression_g(zz, symbols):
+
+    """This is G(z) of SP 800-90B section 6.3.4, summed over the symbols
+    after the dictionary. Each term log2(u) * (1 - z) ** (u - 1) is in
+    the inner sum of every t after both u and the dictionary, and in the
+    outer sum at t = u, so it is summed once with that weight. The terms
+    fall off as (1 - z) ** u and those below 1e-18 are left out. The sum
+    is taken COMPRESSION_TABLE_SIZE terms at a time, with numpy or map().
+    """
+
+    dictionary = COMPRESSION_DICTIONARY
+    if zz <= 0.0 or symbols <= dictionary:
+        return 0.0
+    rr = 1.0 - zz
+    terms = symbols
+    if rr <= 0.0:
+        terms = 1
+    elif rr < 1.0:
+        terms = min(symbols, int(math.log(1e-18) / math.log(rr)) + 1)
+    log_2 = math.log(2)
+    inner = 0.0
+    outer = 0.0
+    for start in xrange(1, terms + 1, COMPRESSION_TABLE_SIZE):
+        end = min(terms + 1, start + COMPRESSION_TABLE_SIZE)
+        first = min(end, max(start, dictionary + 1))
+        if HAS_NUMPY_MODULE:
+            uu = numpy.arange(start, end, dtype=numpy.float64)
+            values = numpy.log(uu) * rr ** (uu - 1.0)
+            weights = symbols - numpy.maximum(uu, dictionary)
+            inner += float(numpy.dot(values, weights))
+            outer += float(values[first - start:].sum())
+            continue
+        values = map(operator.mul, map(math.log, xrange(start, end)),
+                     map(pow, itertools.repeat(rr, end - start),
+                         xrange(start - 1, end - 1)))
+        weights = ([symbols - dictionary] * (first - start) +
+                   range(symbols - first, symbols - end, -1))
+        inner += sum(map(operator.mul, values, weights))
+        outer += sum(values[first - start:])
+    return (zz * zz * inner + zz * outer) / log_2 / (symbols - dictionary)
+
 
 def read_blocks(fin, blocksize=1024):
 
@@ -143,28 +946,181 @@ def read_blocks(fin, blocksize=1024):
             return
 
 
+def entropy_of_stream(fin, blocksize=0, estimators=('shannon',)):
+
+    """This generates a list of the estimates named in estimators for each
+    block of blocksize bytes read from fin. A short last block is
+    included. If blocksize is 0 then the whole stream is one block, read
+    in chunks of READ_CHUNK_SIZE, and the BLOCK_ESTIMATORS may not be
+    used. """
+
+    check_blocksize(blocksize, estimators)
+    ee = entropy_calc(estimators)
+    if blocksize == 0:
+        for bb in read_blocks(fin, READ_CHUNK_SIZE):
+            ee.update(bb)
+        yield map(ee.estimate, estimators)
+        return
+    for bb in read_blocks(fin, blocksize):
+        ee.reset()
+        ee.update(bb)
+        yield map(ee.estimate, estimators)
+
+
+def file_chunks(filename, blocksize=0, chunk_size=PARALLEL_CHUNK_SIZE,
+                estimators=('shannon',)):
+
+    """This returns a list of (filename, start, end, blocksize,
+    estimators) tasks that cover the file. If blocksize is not 0 then each
+    chunk is a whole number of blocks, so no block is split between two
+    tasks. If it is 0 then each chunk is a whole number of Monte Carlo
+    points. """
+
+    size = os.path.getsize(filename)
+    if blocksize:
+        chunk_size = max(1, chunk_size // blocksize) * blocksize
+    else:
+        chunk_size = max(1, chunk_size // MONTE_CARLO_BYTES) * \
+            MONTE_CARLO_BYTES
+    return [(filename, start, min(size, start + chunk_size), blocksize,
+             estimators) for start in xrange(0, size, chunk_size)]
+
+
+def chunk_result(task):
+
+    """This memory-maps one chunk of a file from file_chunks() and returns
+    its entropy_calc.partial() if blocksize is 0, or else the list of the
+    estimates of each block in it. This runs in a worker process. """
+
+    filename, start, end, blocksize, estimators = task
+    fin = open(filename, 'rb')
+    try:
+        mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        fin.close()
+    try:
+        ee = entropy_calc(estimators)
+        if blocksize == 0:
+            ee.update(mm[start:end])
+            return ee.partial()
+        entropies = []
+        for offset in xrange(start, end, blocksize):
+            ee.reset()
+            ee.update(mm[offset:min(end, offset + blocksize)])
+            entropies.append(map(ee.estimate, estimators))
+        return entropies
+    finally:
+        mm.close()
+
+
+def entropy_of_files(filenames, blocksize=0, jobs=None,
+                     chunk_size=PARALLEL_CHUNK_SIZE, estimators=('shannon',)):
+
+    """This generates (filename, estimates) for each block of each file,
+    like entropy_of_stream(), but the chunks of all the files are spread
+    over a pool of jobs worker processes. Partial histograms and sums are
+    added up exactly, so the results are the same as the serial ones.
+    Results are generated in file order as soon as they are ready. If
+    blocksize is 0 then only the MERGEABLE_ESTIMATORS may be used. """
+
+    check_blocksize(blocksize, estimators)
+    if blocksize == 0:
+        for name in estimators:
+            if name not in MERGEABLE_ESTIMATORS:
+                raise ValueError('%s cannot be added up over chunks' % name)
+    tasks = []
+    for filename in filenames:
+        chunks = file_chunks(filename, blocksize, chunk_size, estimators)
+        tasks.extend([(filename, blocksize, chunk) for chunk in chunks])
+        if not chunks:
+            tasks.append((filename, blocksize, None))
+    pool = multiprocessing.Pool(jobs)
+    try:
+        results = pool.imap(_task_result, tasks)
+        ee = entropy_calc(estimators)
+        for nn, (filename, blocksize, chunk) in enumerate(tasks):
+            result = results.next()
+            if blocksize:
+                for estimates in result:
+                    yield filename, estimates
+                continue
+            ee.merge(result)
+            if nn + 1 == len(tasks) or tasks[nn + 1][0] != filename:
+                yield filename, map(ee.estimate, estimators)
+                ee.reset()
+    finally:
+        pool.terminate()
+
+
+def _task_result(task):
+
+    filename, blocksize, chunk = task
+    if chunk is None:
+        # An empty file has no blocks, but as one block it has an entropy
+        # of 0.
+        if blocksize:
+            return []
+        return entropy_calc().partial()
+    return chunk_result(chunk)
+
+
+def check_blocksize(blocksize, estimators):
+
+    """This raises ValueError if blocksize is 0 and estimators has one of
+    the BLOCK_ESTIMATORS, which would keep the whole stream in memory. """
+
+    if blocksize == 0:
+        for name in estimators:
+            if name in BLOCK_ESTIMATORS:
+                raise ValueError('%s needs a blocksize' % name)
+
+
+def parse_estimators(spec):
+
+    """This returns the tuple of estimator names in the comma separated
+    string spec. 'all' stands for every estimator but the
+    BLOCK_ESTIMATORS and 'ent' for the ENT_ESTIMATORS. """
+
+    if spec == 'all':
+        return tuple([name for name in ESTIMATORS
+                      if name not in BLOCK_ESTIMATORS])
+    if spec == 'ent':
+        return ENT_ESTIMATORS
+    estimators = tuple([name.strip() for name in spec.split(',')])
+    for name in estimators:
+        if name not in ESTIMATORS:
+            raise ValueError('unknown estimator: %s' % name)
+    return estimators
+
+
+def print_estimates(estimates):
+
+    print ' '.join(map(str, estimates))
+
+
 def main(options=None, args=None):
 
-    ee = entropy_calc()
-    if len(args) > 0:
+    estimators = parse_estimators(options.estimators)
+    mergeable = [name for name in estimators
+                 if name in MERGEABLE_ESTIMATORS] == list(estimators)
+    if len(args) > 0 and options.jobs and (options.blocksize or mergeable):
+        jobs = options.jobs
+        if jobs < 0:
+            jobs = None
+        for filename, estimates in entropy_of_files(
+                args, options.blocksize, jobs, estimators=estimators):
+            print_estimates(estimates)
+    elif len(args) > 0:
         for filename in args:
-            fin = open(filename)
-            if options.blocksize == 0:
-                ee.update(fin.read())
-                print ee.entropy_shannon()
-            else:
-                for bb in read_blocks(fin, options.blocksize):
-                    ee.update(bb)
-                print ee.entropy_shannon()
+            fin = open(filename, 'rb')
+            for estimates in entropy_of_stream(fin, options.blocksize,
+                                               estimators):
+                print_estimates(estimates)
             fin.close()
     else:
-        if options.blocksize == 0:
-            ee.update(sys.stdin.read())
-            print ee.entropy_shannon()
-        else:
-            for bb in read_blocks(sys.stdin, options.blocksize):
-                ee.update(bb)
-            print ee.entropy_shannon()
+        for estimates in entropy_of_stream(sys.stdin, options.blocksize,
+                                           estimators):
+            print_estimates(estimates)
 
 
 if __name__ == '__main__':
@@ -177,11 +1133,25 @@ if __name__ == '__main__':
         )
         parser.add_option('--blocksize', type='int',
                           default=0, help='set blocksize (default 0)')
+        parser.add_option('--jobs', type='int',
+                          default=0, help='memory-map the files and count' +
+                          ' them on this many processes, -1 for one per CPU' +
+                          ' (default 0, no processes)')
+        parser.add_option('--estimators', default='shannon',
+                          help='comma separated list of the estimates to' +
+                          ' print for each block, from ' +
+                          ', '.join(ESTIMATORS) + ', or all or ent' +
+                          ' (default shannon; tuple needs a --blocksize)')
         parser.add_option('-v', '--verbose', action='store_true',
                           default=False, help='verbose output')
         (options, args) = parser.parse_args()
         #if len(args) < 1:
         #    parser.error ('missing argument')
+        try:
+            check_blocksize(options.blocksize,
+                            parse_estimators(options.estimators))
+        except ValueError as e:
+            parser.error(str(e))
         if options.verbose:
             print(time.asctime())
         exit_code = main(options, args)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# vim:set ft=python fileencoding=utf-8 sr et ts=4 sw=4 : See help 'modeline'
+"""FIPS 140-2 statistical tests.
+
+DESCRIPTION
+
+    This module runs the FIPS 140-2 power-up tests on every consecutive
+    20000 bit block of a stream, as rngtest from rng-tools does. The tests
+    are monobit, poker, runs, long run and continuous run. It is used by
+    extra/fips-140-2.py.
+
+    As with rngtest, the first 32 bits of a stream are not tested. They
+    are only the word the first word of the first block is compared with
+    by the continuous run test. Each later block is compared with the
+    last word of the block before it. A short last block is not tested.
+
+    The tests of a block do not loop over its bits in Python. The block is
+    read as one 20000 bit integer, so that shifts and ands work on all its
+    bits at once. The starts of the runs of each length are found that
+    way, as are the long runs, and they are counted with a popcount made
+    of str.translate(). The poker hands are the hex digits of the block,
+    counted with str.count(). The continuous run test compares the 32 bit
+    words of the block with map().
+
+    test_files() spreads the blocks of several files over a pool of
+    worker processes. Each worker memory-maps its own chunk of blocks.
+
+AUTHOR
+
+    Noah Spurrier <noah@noah.org>
+
+LICENSE
+
+    This license is approved by the OSI and FSF as GPL-compatible.
+        http://opensource.org/licenses/isc-license.txt
+
+    Copyright (c) 2013, Noah Spurrier
+    PERMISSION TO USE, COPY, MODIFY, AND/OR DISTRIBUTE THIS SOFTWARE FOR ANY
+    PURPOSE WITH OR WITHOUT FEE IS HEREBY GRANTED, PROVIDED THAT THE ABOVE
+    COPYRIGHT NOTICE AND THIS PERMISSION NOTICE APPEAR IN ALL COPIES.
+    THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+    WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+    ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+    WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+    ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+    OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+VERSION
+
+    Version 1
+"""
+
+import os
+import sys
+import mmap
+import struct
+import binascii
+import operator
+import itertools
+import multiprocessing
+
+BLOCK_BITS = 20000
+BLOCK_BYTES = BLOCK_BITS // 8
+WORD_BYTES = 4
+TESTS = ('monobit', 'poker', 'runs', 'long_run', 'continuous_run')
+# The limits of FIPS 140-2 change notice 1, as used by rngtest. Monobit
+# and poker must be strictly inside their ranges. The number of runs of
+# each length from 1 to 5, and of 6 or more, must be inside these ranges,
+# inclusive, for each bit value.
+MONOBIT_RANGE = (9725, 10275)
+POKER_RANGE = (2.16, 46.17)
+RUNS_RANGES = ((2315, 2685), (1114, 1386), (527, 723), (240, 384),
+               (103, 209), (103, 209))
+LONG_RUN = 26
+# Blocks handed to each worker process by test_files().
+CHUNK_BLOCKS = 400
+READ_SIZE = BLOCK_BYTES * CHUNK_BLOCKS
+
+BLOCK_MASK = (1 << BLOCK_BITS) - 1
+HEX_DIGITS = '0123456789abcdef'
+POPCOUNTS = ''.join([chr(bin(nn).count('1')) for nn in range(256)])
+_WORDS = struct.Struct('>%dI' % (BLOCK_BYTES // WORD_BYTES))
+
+
+def popcount(value):
+
+    """This returns the number of 1 bits of a BLOCK_BITS bit integer. """
+
+    return sum(bytearray(binascii.unhexlify(
+        '%0*x' % (BLOCK_BYTES * 2, value)).translate(POPCOUNTS)))
+
+
+def _run_counts(runs):
+
+    # runs has a 1 for each bit of the block that has the value whose runs
+    # are counted. The first bit of the block is the top bit. A run starts
+    # where the bit above is not set, and it is at least nn long if the nn
+    # bits from there down are all set.
+    at_least = []
+    starts = runs & ~(runs >> 1)
+    for nn in range(6):
+        starts &= runs << nn
+        at_least.append(popcount(starts))
+    return ([at_least[nn] - at_least[nn + 1] for nn in range(5)] +
+            at_least[5:])
+
+
+def _has_long_run(runs):
+
+    # Each step doubles the length of the runs that are still set.
+    runs &= runs << 1
+    runs &= runs << 2
+    runs &= runs << 4
+    runs &= runs << 8
+    runs &= runs << (LONG_RUN - 16)
+    return runs != 0
+
+
+def block_failures(block, last_word=None):
+
+    """This returns the list of the names of the TESTS that the 2500 byte
+    string block fails. An empty list means the block passed. last_word
+    is the 4 bytes before the block, for the continuous run test, or None
+    to skip comparing the first word of the block. """
+
+    failed = []
+    digits = binascii.hexlify(block)
+    value = int(digits, 16)
+    ones = popcount(value)
+    if not MONOBIT_RANGE[0] < ones < MONOBIT_RANGE[1]:
+        failed.append('monobit')
+    # Each hex digit is a 4 bit poker hand.
+    hands = map(digits.count, HEX_DIGITS)
+    poker = 16.0 / 5000 * sum(map(operator.mul, hands, hands)) - 5000
+    if not POKER_RANGE[0] < poker < POKER_RANGE[1]:
+        failed.append('poker')
+    zeros = ~value & BLOCK_MASK
+    for runs in (zeros, value):
+        counts = _run_counts(runs)
+        if [True for count, (low, high) in zip(counts, RUNS_RANGES)
+                if not low <= count <= high]:
+            failed.append('runs')
+            break
+    if _has_long_run(zeros) or _has_long_run(value):
+        failed.append('long_run')
+    words = _WORDS.unpack(block)
+    if last_word is None:
+        previous = words[:-1]
+        words = words[1:]
+    else:
+        previous = struct.unpack('>I', last_word) + words[:-1]
+    if True in map(operator.eq, words, previous):
+        failed.append('continuous_run')
+    return failed
+
+
+class fips_tester:
+
+    """This tests a stream fed to it in pieces of any size. feed() returns
+    the list of failures of each block it completed. The first WORD_BYTES
+    of the stream are not tested. The counts of blocks and failures are
+    kept for summary(). """
+
+    def __init__(self):
+
+        self.blocks = 0
+        self.failures = 0
+        self.test_failures = dict.fromkeys(TESTS, 0)
+        self._buffer = ''
+        self._last_word = None
+
+    def feed(self, data):
+
+        data = self._buffer + data
+        if self._last_word is None:
+            if len(data) < WORD_BYTES:
+                self._buffer = data
+                return []
+            self._last_word = data[:WORD_BYTES]
+            data = data[WORD_BYTES:]
+        end = len(data) - len(data) % BLOCK_BYTES
+        results = []
+        for offset in xrange(0, end, BLOCK_BYTES):
+            block = data[offset:offset + BLOCK_BYTES]
+            failed = block_failures(block, self._last_word)
+            self._last_word = block[-WORD_BYTES:]
+            self.count(failed)
+            results.append(failed)
+        self._buffer = data[end:]
+        return results
+
+    def count(self, failed):
+
+        self.blocks += 1
+        if failed:
+            self.failures += 1
+        for test in failed:
+            self.test_failures[test] += 1
+
+    def summary(self):
+
+        """This returns a summary of the counts, like rngtest prints. """
+
+        lines = ['FIPS 140-2 successes: %d' % (self.blocks - self.failures),
+                 'FIPS 140-2 failures: %d' % self.failures]
+        lines.append('FIPS 140-2 ' + ', '.join(
+            ['%s: %d' % (test.replace('_', ' ').capitalize(),
+                         self.test_failures[test]) for test in TESTS]))
+        return '\n'.join(lines)
+
+
+def test_stream(fin, read_size=READ_SIZE, tester=None):
+
+    """This generates the failures of each block read from fin. """
+
+    if tester is None:
+        tester = fips_tester()
+    while True:
+        data = fin.read(read_size)
+        if not data:
+            return
+        for failed in tester.feed(data):
+            yield failed
+
+
+def file_chunks(filename, chunk_blocks=CHUNK_BLOCKS):
+
+    """This returns a list of (filename, first, last) tasks for the blocks
+    of the file, numbered from 0. """
+
+    blocks = max(0, os.path.getsize(filename) - WORD_BYTES) // BLOCK_BYTES
+    return [(filename, first, min(blocks, first + chunk_blocks))
+            for first in xrange(0, blocks, chunk_blocks)]
+
+
+def chunk_failures(task):
+
+    """This memory-maps the file of a task from file_chunks() and returns
+    the failures of each of its blocks. This runs in a worker process. """
+
+    filename, first, last = task
+    fin = open(filename, 'rb')
+    try:
+        mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        fin.close()
+    try:
+        results = []
+        for nn in xrange(first, last):
+            offset = WORD_BYTES + nn * BLOCK_BYTES
+            results.append(block_failures(mm[offset:offset + BLOCK_BYTES],
+                                          mm[offset - WORD_BYTES:offset]))
+        return results
+    finally:
+        mm.close()
+
+
+def test_files(filenames, jobs=None, tester=None, chunk_blocks=CHUNK_BLOCKS):
+
+    """This generates (filename, block number, failures) for each block of
+    each file, in order. The blocks are tested by a pool of jobs worker
+    processes. If a fips_tester is given the results are counted in it.
+    """
+
+    tasks = []
+    for filename in filenames:
+        tasks.extend(file_chunks(filename, chunk_blocks))
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for (filename, first, last), results in itertools.izip(
+                tasks, pool.imap(chunk_failures, tasks)):
+            for nn, failed in enumerate(results):
+                if tester is not None:
+                    tester.count(failed)
+                yield filename, first + nn, failed
+    finally:
+        pool.terminate()
+
+
+if __name__ == '__main__':
+
+    # Test stdin and print the summary.
+    tester = fips_tester()
+    for failed in test_stream(sys.stdin, tester=tester):
+        pass
+    print(tester.summary())
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# vim:set ft=python fileencoding=utf-8 sr et ts=4 sw=4 : See help 'modeline'
+"""Pipeline metrics.
+
+DESCRIPTION
+
+    This module samples a set of counters and gauges and publishes them in
+    the Prometheus text exposition format, over HTTP or as a text dump. It
+    is used by "entropy-source --metrics-port" and by the SIGUSR1 handler
+    of entropy-source.
+
+    The counters themselves are plain numbers kept by the code being
+    measured, so counting costs nothing more than an addition. A collect
+    function returns their current values as a list of tuples:
+
+        (name, type, labels, value, help)
+
+    where type is 'counter' or 'gauge' and labels is a dict. The
+    metric_sampler calls it about once a second from its own thread and
+    feeds the increase of each counter to a bandwidth.tiered_bandwidth
+    object, so that a rate per second over the last minute and moving
+    averages are published along with each counter.
+
+AUTHOR
+
+    Noah Spurrier <noah@noah.org>
+
+LICENSE
+
+    This license is approved by the OSI and FSF as GPL-compatible.
+        http://opensource.org/licenses/isc-license.txt
+
+    Copyright (c) 2013, Noah Spurrier
+    PERMISSION TO USE, COPY, MODIFY, AND/OR DISTRIBUTE THIS SOFTWARE FOR ANY
+    PURPOSE WITH OR WITHOUT FEE IS HEREBY GRANTED, PROVIDED THAT THE ABOVE
+    COPYRIGHT NOTICE AND THIS PERMISSION NOTICE APPEAR IN ALL COPIES.
+    THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+    WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+    ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+    WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+    ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+    OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+VERSION
+
+    Version 1
+"""
+
+import sys
+import time
+import threading
+import BaseHTTPServer
+
+import bandwidth
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+def format_value(value):
+
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+
+def format_labels(labels):
+
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        ['%s="%s"' % (key, str(labels[key]).replace('\\', '\\\\')
+                      .replace('"', '\\"').replace('\n', '\\n'))
+         for key in sorted(labels)])
+
+
+class metric_sampler:
+
+    """This samples the metrics returned by collect() and keeps a
+    tiered_bandwidth of each counter. Every metric name is given prefix.
+    Call sample() about once a second, or start() to do that in a daemon
+    thread; start() does nothing if the thread is already running. Call
+    stop() before the program exits, so that the thread is not left
+    sampling while the interpreter shuts down. """
+
+    def __init__(self, collect, prefix='mtee', clock=bandwidth.monotonic):
+
+        self.collect = collect
+        self.prefix = prefix
+        self.clock = clock
+        self._last = {}
+        self._rates = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self, interval=1.0):
+
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+
+        def run():
+            while not self._stopped.wait(interval):
+                self.sample()
+        self._thread = threading.Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def sample(self):
+
+        """This updates the rate of each counter and returns the metrics
+        just collected. """
+
+        metrics = self.collect()
+        self._lock.acquire()
+        try:
+            for name, kind, labels, value, help in metrics:
+                if kind != 'counter':
+                    continue
+                key = (name, tuple(sorted(labels.items())))
+                if key not in self._rates:
+                    self._rates[key] = bandwidth.tiered_bandwidth(
+                        clock=self.clock)
+                    self._last[key] = 0
+                self._rates[key].update(value - self._last[key])
+                self._last[key] = value
+        finally:
+            self._lock.release()
+        return metrics
+
+    def _rate(self, name, labels):
+
+        return self._rates.get((name, tuple(sorted(labels.items()))))
+
+    def prometheus_text(self):
+
+        """This returns every metric in the Prometheus text format. Each
+        counter NAME is published as PREFIX_NAME_total, with a gauge
+        PREFIX_NAME_per_second for its rate over the last minute. """
+
+        metrics = self.sample()
+        lines = []
+        described = set()
+        for name, kind, labels, value, help in metrics:
+            full_name = '%s_%s' % (self.prefix, name)
+            if kind == 'counter':
+                full_name += '_total'
+            if full_name not in described:
+                described.add(full_name)
+                lines.append('# HELP %s %s' % (full_name, help))
+                lines.append('# TYPE %s %s' % (full_name, kind))
+            lines.append('%s%s %s' % (full_name, format_labels(labels),
+                                      format_value(value)))
+        self._lock.acquire()
+        try:
+            for name, kind, labels, value, help in metrics:
+                if kind != 'counter':
+                    continue
+                rate_name = '%s_%s_per_second' % (self.prefix, name)
+                if rate_name not in described:
+                    described.add(rate_name)
+                    lines.append('# HELP %s Rate of %s_%s_total over the'
+                                 ' last minute.' % (rate_name, self.prefix,
+                                                    name))
+                    lines.append('# TYPE %s gauge' % rate_name)
+                rate = self._rate(name, labels)
+                lines.append('%s%s %s' % (rate_name, format_labels(labels),
+                                          format_value(
+                                              rate.bandwidth_covering(60.0))))
+        finally:
+            self._lock.release()
+        return '\n'.join(lines) + '\n'
+
+    def text_dump(self):
+
+        """This returns a human readable table of every metric, with the
+        1 minute rate and the 1, 5 and 15 minute moving averages of each
+        counter. """
+
+        metrics = self.sample()
+        lines = ['# %s metrics at %s' % (self.prefix, time.asctime())]
+        self._lock.acquire()
+        try:
+            for name, kind, labels, value, help in metrics:
+                label = name + format_labels(labels)
+                if kind == 'counter':
+                    rate = self._rate(name, labels)
+                    lines.append('%-44s %14s  1 min %12.3f/s  ewma %s' %
+                                 (label, format_value(value),
+                                  rate.bandwidth_covering(60.0),
+                                  ' '.join(['%.3f' % rr
+                                            for rr in rate.ewma()])))
+                else:
+                    lines.append('%-44s %14s' % (label, format_value(value)))
+        finally:
+            self._lock.release()
+        return '\n'.join(lines) + '\n'
+
+
+class metrics_server:
+
+    """This serves the Prometheus text of a metric_sampler on
+    http://HOST:PORT/metrics from a daemon thread. By default it only
+    listens on localhost. """
+
+    def __init__(self, sampler, port, host='127.0.0.1'):
+
+        class handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = sampler.prometheus_text()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = BaseHTTPServer.HTTPServer((host, port), handler)
+        self.port = self.httpd.server_address[1]
+        self._thread = threading.Thread(target=self.httpd.serve_forever)
+        self._thread.daemon = True
+
+    def start(self):
+
+        self._thread.start()
+
+    def close(self):
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+
+    # Serve a counter of seconds, for testing a Prometheus scraper.
+    start_time = time.time()
+    sampler = metric_sampler(lambda: [
+        ('uptime_seconds', 'counter', {}, int(time.time() - start_time),
+         'Seconds since this test server started.')])
+    sampler.start()
+    server = metrics_server(sampler, int(sys.argv[1]) if len(sys.argv) > 1
+                            else 9465)
+    sys.stderr.write('serving on http://127.0.0.1:%d/metrics\n' % server.port)
+    server.start()
+    while True:
+        time.sleep(3600)